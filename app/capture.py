@@ -0,0 +1,63 @@
+import os
+import hmac
+import json
+import time
+import queue
+import hashlib
+import threading
+
+class TrafficCapture:
+    """
+    Запись "формы" запросов на синтез в JSONL для последующего воспроизведения.
+    Сам текст не сохраняется: только длина и HMAC с секретом развёртывания
+    (повторы остаются видны, но короткие фразы нельзя подобрать по словарю).
+    Запись на диск идёт в фоновом потоке, чтобы не блокировать event loop.
+    """
+    def __init__(self, path: str = None, salt: str = None):
+        self.path = path
+        self._file = None
+        self._queue = queue.Queue()
+        if not self.path:
+            return
+        if salt:
+            self._salt = salt.encode('utf-8')
+        else:
+            # Без CAPTURE_SALT повторы различимы только в пределах одного запуска
+            print("⚠️  CAPTURE_SALT is not set, using a random per-process secret")
+            self._salt = os.urandom(32)
+        try:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            # Один открытый файл с построчной буферизацией на всё время работы
+            self._file = open(self.path, 'a', encoding='utf-8', buffering=1)
+        except Exception as e:
+            print(f"⚠️  Traffic capture disabled, cannot open {self.path}: {e}")
+            self.path = None
+            return
+        threading.Thread(target=self._writer, name='traffic-capture', daemon=True).start()
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.path)
+
+    def record(self, text: str, ts: float = None, **fields):
+        """ts - время поступления запроса (time.time()); по нему replay восстанавливает темп"""
+        if not self.enabled:
+            return
+        entry = {
+            'ts': round(ts if ts is not None else time.time(), 3),
+            'text_len': len(text),
+            'text_hash': hmac.new(self._salt, text.encode('utf-8'), hashlib.sha256).hexdigest()[:16],
+        }
+        entry.update(fields)
+        self._queue.put(json.dumps(entry, ensure_ascii=False))
+
+    def _writer(self):
+        while True:
+            line = self._queue.get()
+            try:
+                self._file.write(line + '\n')
+            except Exception as e:
+                # Захват трафика не должен ломать обработку запросов
+                print(f"⚠️  Traffic capture write failed: {e}")
@@ -1,15 +1,34 @@
 from fastapi import FastAPI, Request, Form, HTTPException, UploadFile, File
-from fastapi.responses import FileResponse, HTMLResponse
+from fastapi.responses import FileResponse, HTMLResponse, StreamingResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
 import os
-from .tts_service import TTSService
+import time
+import asyncio
+import threading
+from .tts_service import TTSService, SynthesisCancelled, DeadlineExceeded
 from .cache import FileCache
-from .utils import split_text
+from .capture import TrafficCapture
+from .scheduler import SynthesisScheduler, PRIORITY_CLASSES
+from .utils import split_text, MEDIA_TYPES, RAW_FORMATS
 
 PORT = int(os.getenv('PORT', 5000))
 CACHE_TTL = int(os.getenv('CACHE_TTL_SECONDS', 86400))
 MAX_TEXT_LENGTH = int(os.getenv('MAX_TEXT_LENGTH', 1000))
+CAPTURE_FILE = os.getenv('CAPTURE_FILE', '')
+# Секрет для HMAC текста в захвате трафика
+CAPTURE_SALT = os.getenv('CAPTURE_SALT', '')
+SCHEDULER_AGING = float(os.getenv('SCHEDULER_AGING', 1.0))
+# Число реплик модели (слотов движка) и сколько из них может занять один запрос
+ENGINE_WORKERS = int(os.getenv('ENGINE_WORKERS', 1))
+SEGMENT_PARALLELISM = int(os.getenv('SEGMENT_PARALLELISM', 1))
+# Максимальная длина части текста: части синтезируются отдельно (и параллельно).
+# По умолчанию текст не делится, если запрос не может занять больше одного слота
+SEGMENT_MAX_LEN = int(os.getenv('SEGMENT_MAX_LEN', 200 if SEGMENT_PARALLELISM > 1 else MAX_TEXT_LENGTH))
+# Размер LRU кэша токенизации частей текста (0 - выключен)
+PREPROCESS_CACHE_SIZE = int(os.getenv('PREPROCESS_CACHE_SIZE', 4096))
+# Класс приоритета по умолчанию для /synthesize (realtime, interactive, batch)
+SYNTHESIZE_PRIORITY = os.getenv('SYNTHESIZE_PRIORITY', 'interactive')
 
 app = FastAPI(title='Coqui TTS API')
 app.mount('/static', StaticFiles(directory='app/static'), name='static')
@@ -19,7 +38,11 @@ templates = Jinja2Templates(directory='app/templates')
 cache = FileCache(cache_dir='cache', ttl=CACHE_TTL)
 # Попытка определить GPU по окружению
 use_gpu = os.getenv('USE_GPU', '0') == '1'
-tts = TTSService(use_gpu=use_gpu, cache=cache)
+scheduler = SynthesisScheduler(workers=ENGINE_WORKERS, aging=SCHEDULER_AGING)
+tts = TTSService(use_gpu=use_gpu, cache=cache, scheduler=scheduler, segment_parallelism=SEGMENT_PARALLELISM,
+                 preprocess_cache_size=PREPROCESS_CACHE_SIZE)
+# Опциональная запись формы трафика (для replay_traffic.py)
+capture = TrafficCapture(CAPTURE_FILE, salt=CAPTURE_SALT)
 
 # Предзагрузка модели при старте
 @app.on_event("startup")
@@ -51,56 +74,241 @@ async def get_speakers(model_id: str):
     speakers = tts.get_speakers(model_id)
     return {'speakers': speakers}
 
+def close_generator(gen):
+    """Закрытие потокового генератора; если next() ещё выполняется в другом потоке - ждём его"""
+    while True:
+        try:
+            gen.close()
+            return
+        except ValueError:
+            # generator already executing: текущая часть прерывается по cancel_event
+            time.sleep(0.05)
+
+async def watch_disconnect(request: Request, cancel_event: threading.Event):
+    """Отмена синтеза, если клиент закрыл соединение"""
+    while not cancel_event.is_set():
+        if await request.is_disconnected():
+            cancel_event.set()
+            return
+        await asyncio.sleep(0.5)
+
 @app.post('/synthesize')
 async def synthesize(
+    request: Request,
     text: str = Form(...),
     model_id: str = Form('xtts-v2'),
     language: str = Form('en'),
     speaker: str = Form(None),
-    fmt: str = Form('wav')
+    fmt: str = Form('wav'),
+    deadline_ms: int = Form(None),
+    priority: str = Form(None),
+    sample_rate: int = Form(None),
+    channels: int = Form(None),
+    stream: bool = Form(False)
 ):
     if not text:
         raise HTTPException(status_code=400, detail='Text is required')
     if len(text) > MAX_TEXT_LENGTH:
         raise HTTPException(status_code=400, detail=f'Max text length is {MAX_TEXT_LENGTH}')
+    if deadline_ms is not None and deadline_ms <= 0:
+        raise HTTPException(status_code=400, detail='deadline_ms must be positive')
+    priority = priority or SYNTHESIZE_PRIORITY
+    if priority not in PRIORITY_CLASSES:
+        raise HTTPException(status_code=400, detail=f'Unknown priority: {priority}')
+    if model_id not in tts.get_models():
+        raise HTTPException(status_code=400, detail=f'Unknown model: {model_id}')
+    if fmt not in MEDIA_TYPES:
+        raise HTTPException(status_code=400, detail=f'Unsupported format: {fmt}')
+    if stream and fmt not in RAW_FORMATS:
+        raise HTTPException(status_code=400, detail=f'Streaming is supported only for: {", ".join(RAW_FORMATS)}')
+    # У сырых потоков нет заголовка, поэтому частота всегда задаётся явно:
+    # G.711 (μ-law / A-law) по определению 8 кГц, s16le - 16 кГц
+    if sample_rate is None and fmt in RAW_FORMATS:
+        sample_rate = 16000 if fmt == 's16le' else 8000
+    if sample_rate is not None and not 8000 <= sample_rate <= 48000:
+        raise HTTPException(status_code=400, detail='sample_rate must be between 8000 and 48000')
+    if channels is not None and channels not in (1, 2):
+        raise HTTPException(status_code=400, detail='channels must be 1 or 2')
 
+    start_time = time.time()
+    # Дедлайн отсчитывается от начала обработки запроса
+    deadline = time.monotonic() + deadline_ms / 1000 if deadline_ms else None
     # Разбиваем текст на части, синтезируем по частям и объединяем
-    parts = split_text(text, max_len=MAX_TEXT_LENGTH)
+    parts = split_text(text, max_len=SEGMENT_MAX_LEN)
     # Генерируем имя кэша
-    cache_key = tts.cache_key(text, model_id=model_id, language=language, speaker=speaker, fmt=fmt)
+    cache_key = tts.cache_key(text, model_id=model_id, language=language, speaker=speaker, fmt=fmt,
+                              sample_rate=sample_rate, channels=channels)
+    # Все профили вывода рендерятся из одного синтеза в родном wav
+    base_key = tts.cache_key(text, model_id=model_id, language=language, speaker=speaker, fmt='wav')
+    headers = {}
+    if fmt in RAW_FORMATS:
+        headers['X-Sample-Rate'] = str(sample_rate)
+        headers['X-Channels'] = str(channels or 1)
+
+    def record(cache_status: str, status: int):
+        capture.record(
+            text,
+            ts=start_time,
+            parts=len(parts),
+            model_id=model_id,
+            language=language,
+            speaker=speaker,
+            fmt=fmt,
+            sample_rate=sample_rate,
+            channels=channels,
+            stream=stream,
+            deadline_ms=deadline_ms,
+            priority=priority,
+            cache=cache_status,
+            status=status,
+            latency_ms=round((time.time() - start_time) * 1000, 1)
+        )
     
     if cache.exists(cache_key):
         cached_path = cache.path(cache_key)
+        record('hit', 200)
         return FileResponse(
             cached_path,
-            media_type='audio/' + fmt,
-            filename=f'{cache_key}.{fmt}'
+            media_type=MEDIA_TYPES[fmt],
+            filename=f'{cache_key}.{fmt}',
+            headers={**headers, 'X-Cache': 'HIT'}
+        )
+
+    if stream and not cache.exists(base_key):
+        # Части отдаются по порядку по мере готовности.
+        # Если синтез уже есть в кэше, ниже он просто перекодируется в нужный профиль.
+        cancel_event = threading.Event()
+
+        def cache_result(wav_path: str):
+            # Кэшируем родной wav и профиль, перекодированный из него целиком, как без стриминга:
+            # потоковые части ресемплируются по отдельности и побайтно отличаются от него
+            try:
+                cache.put(base_key, wav_path)
+                out_path = tts.transcode_file(wav_path, fmt, sample_rate=sample_rate, channels=channels)
+                cache.put(cache_key, out_path)
+                os.remove(out_path)
+            finally:
+                os.remove(wav_path)
+
+        async def stream_and_cache():
+            import anyio
+            from starlette.concurrency import iterate_in_threadpool, run_in_threadpool
+
+            status = 499  # поток прерван до конца - клиент ушёл
+            watcher = asyncio.create_task(watch_disconnect(request, cancel_event))
+            gen = tts.synthesize_stream(
+                parts,
+                model_id=model_id,
+                language=language,
+                speaker=speaker,
+                out_format=fmt,
+                cancel_event=cancel_event,
+                deadline=deadline,
+                priority=priority,
+                sample_rate=sample_rate,
+                channels=channels,
+                on_complete=cache_result
+            )
+            try:
+                async for chunk in iterate_in_threadpool(gen):
+                    yield chunk
+                status = 200
+            except DeadlineExceeded:
+                # Заголовки уже отправлены - просто обрываем поток
+                status = 504
+            except SynthesisCancelled:
+                status = 499
+            except Exception:
+                status = 500
+                raise
+            finally:
+                # Освобождаем движок: текущая часть и очередь запроса прерываются
+                cancel_event.set()
+                watcher.cancel()
+                # Закрываем генератор сразу и вне event loop: ожидание частей и удаление
+                # временных файлов не должны ждать сборщика мусора
+                with anyio.CancelScope(shield=True):
+                    await run_in_threadpool(close_generator, gen)
+                record('miss', status)
+
+        return StreamingResponse(
+            stream_and_cache(),
+            media_type=MEDIA_TYPES[fmt],
+            headers={**headers, 'X-Cache': 'MISS'}
         )
 
     # Генерация
+    cache_status = 'miss'
+    cancel_event = threading.Event()
+    watcher = asyncio.create_task(watch_disconnect(request, cancel_event))
     try:
         from starlette.concurrency import run_in_threadpool
         
-        # Запускаем синхронный метод в threadpool, чтобы не блокировать event loop
-        out_path = await run_in_threadpool(
-            tts.synthesize_to_file,
-            parts, 
-            model_id=model_id, 
-            language=language, 
-            speaker=speaker, 
-            out_format=fmt
-        )
-        
-        cache.put(cache_key, out_path)
+        if cache.exists(base_key):
+            # Синтез уже есть в кэше - только перекодируем в нужный профиль
+            cache_status = 'partial'
+            wav_path = cache.path(base_key)
+        else:
+            # Запускаем синхронный метод в threadpool, чтобы не блокировать event loop
+            wav_path = await run_in_threadpool(
+                tts.synthesize_to_file,
+                parts, 
+                model_id=model_id, 
+                language=language, 
+                speaker=speaker, 
+                out_format='wav',
+                cancel_event=cancel_event,
+                deadline=deadline,
+                priority=priority
+            )
+            cache.put(base_key, wav_path)
+            if cache_key != base_key:
+                # Отдавать будем перекодированный файл - временный wav больше не нужен,
+                # перекодируем из копии в кэше
+                os.remove(wav_path)
+                wav_path = cache.path(base_key)
+
+        if cache_key == base_key:
+            out_path = wav_path
+        else:
+            out_path = await run_in_threadpool(
+                tts.transcode_file,
+                wav_path,
+                fmt,
+                sample_rate=sample_rate,
+                channels=channels
+            )
+            cache.put(cache_key, out_path)
+        record(cache_status, 200)
         
         return FileResponse(
             out_path,
-            media_type='audio/' + fmt,
+            media_type=MEDIA_TYPES[fmt],
             filename=os.path.basename(out_path),
-            content_disposition_type='inline'
+            content_disposition_type='inline',
+            headers={**headers, 'X-Cache': cache_status.upper()}
         )
+    except DeadlineExceeded as e:
+        record(cache_status, 504)
+        raise HTTPException(status_code=504, detail=str(e))
+    except SynthesisCancelled as e:
+        # Клиент уже отключился, ответ никто не прочитает
+        record(cache_status, 499)
+        raise HTTPException(status_code=499, detail=str(e))
     except Exception as e:
+        record(cache_status, 500)
         raise HTTPException(status_code=500, detail=str(e))
+    finally:
+        watcher.cancel()
+
+@app.get('/api/stats')
+async def stats():
+    """Состояние очереди синтеза и кэша предобработки текста"""
+    return {
+        'scheduler': scheduler.stats(),
+        'segment_parallelism': tts.segment_parallelism,
+        'preprocess': tts.preprocess_stats()
+    }
 
 @app.get('/download/{filename}')
 async def download(filename: str):
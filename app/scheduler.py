@@ -0,0 +1,129 @@
+import time
+import itertools
+import threading
+from contextlib import contextmanager
+
+# Классы приоритета: множитель к оценке стоимости (меньше - раньше)
+PRIORITY_CLASSES = {
+    'realtime': 0.25,
+    'interactive': 1.0,
+    'batch': 4.0,
+}
+
+class _Job:
+    __slots__ = ('seq', 'model_id', 'cost', 'weight', 'enqueued')
+
+    def __init__(self, seq, model_id, cost, weight, enqueued=None):
+        self.seq = seq
+        self.model_id = model_id
+        self.cost = cost
+        self.weight = weight
+        self.enqueued = enqueued if enqueued is not None else time.monotonic()
+
+class SynthesisScheduler:
+    """
+    Очередь к движку синтеза: shortest-job-first по оценке стоимости со "старением".
+
+    Стоимость задачи (в секундах) оценивается по длине текста, числу частей и
+    наблюдаемой скорости модели. Из ожидающих задач движок получает та, у которой
+    меньше cost * weight - aging * время_ожидания, поэтому длинные задачи
+    со временем всё равно продвигаются вперёд.
+    """
+    def __init__(self, workers: int = 1, aging: float = 1.0, default_chars_per_sec: float = 20.0,
+                 segment_overhead: float = 0.3, smoothing: float = 0.2):
+        self.workers = workers
+        self.aging = aging
+        self.default_chars_per_sec = default_chars_per_sec
+        self.segment_overhead = segment_overhead
+        self.smoothing = smoothing
+        self._cond = threading.Condition()
+        self._free = workers
+        self._waiting = []
+        self._seq = itertools.count()
+        # model_id -> (накладные расходы на часть в секундах, символов в секунду)
+        self._model = {}
+        # model_id -> экспоненциально взвешенные суммы для МНК: seconds = overhead * segments + chars / speed
+        self._sums = {}
+
+    def estimate(self, model_id: str, text_len: int, segments: int = 1) -> float:
+        """Оценка времени синтеза в секундах"""
+        overhead, chars_per_sec = self._model.get(model_id, (self.segment_overhead, self.default_chars_per_sec))
+        return segments * overhead + text_len / chars_per_sec
+
+    def observe(self, model_id: str, text_len: int, segments: int, seconds: float):
+        """
+        Обновление оценки модели по фактическому времени синтеза.
+        Накладные расходы на часть и скорость подбираются вместе (взвешенный МНК
+        с затуханием), поэтому учитываются и быстрые короткие части.
+        """
+        if text_len <= 0 or segments <= 0 or seconds <= 0:
+            return
+        with self._cond:
+            decay = 1.0 - self.smoothing
+            nn, nc, cc, nt, ct = (decay * v for v in self._sums.get(model_id, (0.0,) * 5))
+            nn += segments * segments
+            nc += segments * text_len
+            cc += text_len * text_len
+            nt += segments * seconds
+            ct += text_len * seconds
+            self._sums[model_id] = (nn, nc, cc, nt, ct)
+
+            det = nn * cc - nc * nc
+            overhead = (nt * cc - nc * ct) / det if det > 1e-9 * nn * cc else -1.0
+            if not 0.0 <= overhead <= seconds:
+                # Длины частей пока не различаются (или оценка неустойчива) - берём
+                # накладные расходы по умолчанию, но не больше доли наблюдаемого времени
+                overhead = min(self.segment_overhead, 0.5 * nt / nn)
+            sec_per_char = (ct - overhead * nc) / cc
+            if sec_per_char <= 0:
+                return
+            self._model[model_id] = (overhead, 1.0 / sec_per_char)
+
+    def _score(self, job: _Job, now: float) -> float:
+        return job.cost * job.weight - self.aging * (now - job.enqueued)
+
+    def _next(self) -> _Job:
+        now = time.monotonic()
+        return min(self._waiting, key=lambda j: (self._score(j, now), j.seq))
+
+    @contextmanager
+    def slot(self, model_id: str, text_len: int, segments: int = 1, priority: str = 'interactive', check=None, since: float = None):
+        """
+        Ожидание своей очереди к движку.
+        check - функция без аргументов, бросающая исключение, если ждать больше не нужно.
+        since - время постановки в очередь (time.monotonic()), если задача - часть более раннего запроса.
+        """
+        if priority not in PRIORITY_CLASSES:
+            raise ValueError(f'Unknown priority class: {priority}')
+        job = _Job(next(self._seq), model_id, self.estimate(model_id, text_len, segments), PRIORITY_CLASSES[priority], since)
+        with self._cond:
+            self._waiting.append(job)
+            try:
+                while not (self._free > 0 and self._next() is job):
+                    self._cond.wait(timeout=0.1)
+                    if check is not None:
+                        check()
+            except BaseException:
+                self._waiting.remove(job)
+                self._cond.notify_all()
+                raise
+            self._waiting.remove(job)
+            self._free -= 1
+        try:
+            yield job
+        finally:
+            with self._cond:
+                self._free += 1
+                self._cond.notify_all()
+
+    def stats(self) -> dict:
+        with self._cond:
+            now = time.monotonic()
+            return {
+                'workers': self.workers,
+                'busy': self.workers - self._free,
+                'queued': len(self._waiting),
+                'oldest_wait_sec': round(max((now - j.enqueued for j in self._waiting), default=0.0), 3),
+                'chars_per_sec': {m: round(v[1], 2) for m, v in self._model.items()},
+                'segment_overhead_sec': {m: round(v[0], 3) for m, v in self._model.items()},
+            }
@@ -1,15 +1,38 @@
 import os
+import queue
 import tempfile
+import threading
+from contextlib import contextmanager
+from cachetools import LRUCache
 from TTS.api import TTS
 from pydub import AudioSegment
 from typing import List
+from .scheduler import SynthesisScheduler
+from .utils import export_audio, encode_raw, RAW_FORMATS
+
+class SynthesisCancelled(Exception):
+    """Синтез прерван: клиент отключился"""
+
+class DeadlineExceeded(SynthesisCancelled):
+    """Синтез прерван: истёк дедлайн запроса"""
 
 class TTSService:
-    def __init__(self, use_gpu: bool = False, cache=None):
-        import threading
+    def __init__(self, use_gpu: bool = False, cache=None, scheduler: SynthesisScheduler = None, segment_parallelism: int = 1,
+                 preprocess_cache_size: int = 4096):
         self.use_gpu = use_gpu
         self.cache = cache
-        self._lock = threading.RLock()  # Рекурсивная блокировка для GPU
+        self._lock = threading.RLock()  # Рекурсивная блокировка для загрузки моделей
+        # Очередь к движку: один слот = одна реплика модели, занятая синтезом одной части
+        self.scheduler = scheduler or SynthesisScheduler()
+        # Сколько частей одного запроса может синтезироваться одновременно
+        self.segment_parallelism = segment_parallelism
+        self._replicas = {}  # model_id -> очередь свободных реплик
+        self._replica_count = {}
+        # LRU кэш токенов по (model, language, text); 0 - выключен
+        self._preprocess_cache = LRUCache(maxsize=preprocess_cache_size) if preprocess_cache_size > 0 else None
+        self._preprocess_lock = threading.Lock()
+        self._preprocess_hits = 0
+        self._preprocess_misses = 0
         
         # XTTS v2 и пользовательские модели
         self.models = {
@@ -50,64 +73,121 @@ class TTSService:
         if model_id not in self._instances:
             with self._lock:  # Блокируем создание инстанса
                 if model_id not in self._instances: # Double check locking
-                    config = self.models.get(model_id)
-                    if not config:
-                        raise RuntimeError(f'Model not found: {model_id}')
-                    
-                    print(f"Loading model: {model_id} from {config['name']}...")
-                    model_dir = config['name']
-                    try:
-                        if config['name'].startswith('/app/models'):
-                            from TTS.config import load_config
-                            from TTS.tts.models import setup_model as setup_tts_model
-                            from TTS.utils.synthesizer import Synthesizer
-                            
-                            print(f"Loading local XTTS model: {model_id} from {model_dir}")
-                            cfg = load_config(os.path.join(model_dir, 'config.json'))
-                            model = setup_tts_model(cfg)
-                            
-                            # Передаем ОБА параметра, чтобы избежать бага с двойным model.pth
-                            model.load_checkpoint(
-                                cfg, 
-                                checkpoint_dir=model_dir, 
-                                checkpoint_path=os.path.join(model_dir, 'model.pth'), 
-                                eval=True
-                            )
-                            if self.use_gpu:
-                                model.cuda()
-                            
-                            # Оборачиваем в TTS для совместимости с остальным кодом (метод tts_to_file)
-                            from TTS.api import TTS as TTSAPI
-                            tts_instance = TTSAPI(gpu=self.use_gpu)
-                            
-                            # Оборачиваем в Synthesizer
-                            synth = Synthesizer(None, None, use_cuda=self.use_gpu)
-                            synth.tts_config = cfg
-                            synth.tts_model = model
-                            
-                            tts_instance.synthesizer = synth
-                            tts_instance.model_name = "xtts" # Чтобы срабатывала логика XTTS
-                            
-                            # Устанавливаем sample rate для сохранения wav
-                            synth.output_sample_rate = 24000
-                            if hasattr(cfg, 'audio') and 'output_sample_rate' in cfg.audio:
-                                synth.output_sample_rate = cfg.audio['output_sample_rate']
-                            elif hasattr(cfg, 'audio') and 'sample_rate' in cfg.audio:
-                                synth.output_sample_rate = cfg.audio['sample_rate']
-                                
-                            self._instances[model_id] = tts_instance
-                        else:
-                            self._instances[model_id] = TTS(
-                                model_name=config['name'], 
-                                progress_bar=False, 
-                                gpu=self.use_gpu
-                            )
-                    except Exception as e:
-                        import traceback
-                        traceback.print_exc()
-                        raise e
+                    self._instances[model_id] = self._load_model(model_id)
         return self._instances[model_id]
 
+    def _load_model(self, model_id: str):
+        """Загрузка нового инстанса модели (без кэширования)"""
+        config = self.models.get(model_id)
+        if not config:
+            raise RuntimeError(f'Model not found: {model_id}')
+        
+        print(f"Loading model: {model_id} from {config['name']}...")
+        model_dir = config['name']
+        try:
+            if config['name'].startswith('/app/models'):
+                from TTS.config import load_config
+                from TTS.tts.models import setup_model as setup_tts_model
+                from TTS.utils.synthesizer import Synthesizer
+                
+                print(f"Loading local XTTS model: {model_id} from {model_dir}")
+                cfg = load_config(os.path.join(model_dir, 'config.json'))
+                model = setup_tts_model(cfg)
+                
+                # Передаем ОБА параметра, чтобы избежать бага с двойным model.pth
+                model.load_checkpoint(
+                    cfg, 
+                    checkpoint_dir=model_dir, 
+                    checkpoint_path=os.path.join(model_dir, 'model.pth'), 
+                    eval=True
+                )
+                if self.use_gpu:
+                    model.cuda()
+                
+                # Оборачиваем в TTS для совместимости с остальным кодом (метод tts_to_file)
+                from TTS.api import TTS as TTSAPI
+                tts_instance = TTSAPI(gpu=self.use_gpu)
+                
+                # Оборачиваем в Synthesizer
+                synth = Synthesizer(None, None, use_cuda=self.use_gpu)
+                synth.tts_config = cfg
+                synth.tts_model = model
+                
+                tts_instance.synthesizer = synth
+                tts_instance.model_name = "xtts" # Чтобы срабатывала логика XTTS
+                
+                # Устанавливаем sample rate для сохранения wav
+                synth.output_sample_rate = 24000
+                if hasattr(cfg, 'audio') and 'output_sample_rate' in cfg.audio:
+                    synth.output_sample_rate = cfg.audio['output_sample_rate']
+                elif hasattr(cfg, 'audio') and 'sample_rate' in cfg.audio:
+                    synth.output_sample_rate = cfg.audio['sample_rate']
+                    
+            else:
+                tts_instance = TTS(
+                    model_name=config['name'], 
+                    progress_bar=False, 
+                    gpu=self.use_gpu
+                )
+        except Exception as e:
+            import traceback
+            traceback.print_exc()
+            raise e
+        self._install_preprocess_cache(model_id, tts_instance)
+        return tts_instance
+
+    def _install_preprocess_cache(self, model_id: str, tts):
+        """
+        Кэш предобработки текста. Очистка, раскрытие чисел и сокращений и BPE-токенизация
+        выполняются в tokenizer модели (прочие: text_to_ids, XTTS: только encode), который
+        вызывается из inference. Оборачиваем эти методы, чтобы повторные части текста
+        сразу получали готовые токены. Кэш общий для всех реплик модели.
+        """
+        if self._preprocess_cache is None:
+            return
+        model = getattr(getattr(tts, 'synthesizer', None), 'tts_model', None)
+        tokenizer = getattr(model, 'tokenizer', None)
+        if tokenizer is None:
+            return
+        # Оборачиваем только внешнюю точку входа: TTSTokenizer.text_to_ids сам вызывает encode,
+        # и двойная обёртка считала бы каждый промах дважды
+        for name in ('text_to_ids', 'encode'):
+            method = getattr(tokenizer, name, None)
+            if callable(method):
+                setattr(tokenizer, name, self._cached_tokenize(model_id, name, method))
+                break
+
+    def _cached_tokenize(self, model_id: str, name: str, method):
+        def tokenize(text, *args, **kwargs):
+            # language передаётся по-разному: encode(txt, lang), text_to_ids(text, language=...)
+            language = kwargs.get('lang', kwargs.get('language', args[0] if args else None))
+            key = (model_id, name, language, text)
+            with self._preprocess_lock:
+                tokens = self._preprocess_cache.get(key)
+                if tokens is not None:
+                    self._preprocess_hits += 1
+                    return list(tokens)
+                self._preprocess_misses += 1
+            tokens = method(text, *args, **kwargs)
+            if isinstance(tokens, list):
+                with self._preprocess_lock:
+                    self._preprocess_cache[key] = tuple(tokens)
+            return tokens
+        return tokenize
+
+    def preprocess_stats(self) -> dict:
+        """Счётчики кэша предобработки текста"""
+        with self._preprocess_lock:
+            total = self._preprocess_hits + self._preprocess_misses
+            return {
+                'enabled': self._preprocess_cache is not None,
+                'size': len(self._preprocess_cache) if self._preprocess_cache is not None else 0,
+                'maxsize': self._preprocess_cache.maxsize if self._preprocess_cache is not None else 0,
+                'hits': self._preprocess_hits,
+                'misses': self._preprocess_misses,
+                'hit_ratio': round(self._preprocess_hits / total, 4) if total else 0.0,
+            }
+
     def get_models(self):
         return self.models
 
@@ -127,126 +207,299 @@ class TTSService:
             traceback.print_exc()
             return []
 
-    def cache_key(self, text: str, model_id: str, language: str = 'en', speaker: str = None, fmt: str = 'wav') -> str:
+    def cache_key(self, text: str, model_id: str, language: str = 'en', speaker: str = None, fmt: str = 'wav',
+                  sample_rate: int = None, channels: int = None) -> str:
         import hashlib
-        k = hashlib.sha1(f"{model_id}|{language}|{speaker}|{text}|{fmt}".encode('utf-8')).hexdigest()
+        key = f"{model_id}|{language}|{speaker}|{text}|{fmt}"
+        # Профиль вывода добавляется только если отличается от родного, чтобы не сбрасывать старый кэш
+        if sample_rate or channels:
+            key += f"|{sample_rate}|{channels}"
+        k = hashlib.sha1(key.encode('utf-8')).hexdigest()
         return k
 
-    def synthesize_to_file(self, parts: List[str], model_id: str = 'xtts-v2', language: str = 'en', speaker: str = None, out_format: str = 'wav') -> str:
+    @staticmethod
+    def _check_cancelled(cancel_event=None, deadline: float = None):
+        """Проверка отмены запроса (cancel_event - threading.Event, deadline - time.monotonic())"""
         import time
+        if cancel_event is not None and cancel_event.is_set():
+            raise SynthesisCancelled('Synthesis cancelled: client disconnected')
+        if deadline is not None and time.monotonic() >= deadline:
+            raise DeadlineExceeded('Synthesis cancelled: deadline exceeded')
+
+    def _stopping_criteria(self, check):
+        """
+        Отмена внутри генерации XTTS: дополнительные kwargs tts_to_file доходят
+        до generate() из transformers, где stopping_criteria проверяется на каждом токене.
+        """
+        try:
+            from transformers import StoppingCriteria, StoppingCriteriaList
+        except ImportError:
+            return None
+
+        class CancelCriteria(StoppingCriteria):
+            def __call__(self, input_ids, scores, **kwargs):
+                try:
+                    check()
+                except SynthesisCancelled:
+                    return True
+                return False
+
+        return StoppingCriteriaList([CancelCriteria()])
+
+    @contextmanager
+    def _replica(self, model_id: str):
+        """
+        Выдача свободной реплики модели. Реплики создаются лениво, не больше
+        числа слотов планировщика; первая реплика - общий инстанс из _get_tts.
+        """
+        with self._lock:
+            pool = self._replicas.setdefault(model_id, queue.LifoQueue())
+        try:
+            tts = pool.get_nowait()
+        except queue.Empty:
+            tts = None
+            with self._lock:
+                count = self._replica_count.get(model_id, 0)
+                if count < self.scheduler.workers:
+                    self._replica_count[model_id] = count + 1
+                    create = True
+                else:
+                    create = False
+            if create:
+                try:
+                    tts = self._get_tts(model_id) if count == 0 else self._load_model(model_id)
+                except Exception:
+                    with self._lock:
+                        self._replica_count[model_id] -= 1
+                    raise
+            else:
+                tts = pool.get()
+        try:
+            yield tts
+        finally:
+            pool.put(tts)
+
+    def _synthesize_part(self, tts, text: str, out: str, model_id: str, language: str, speaker: str, stopping_criteria=None):
         from datetime import datetime
+
+        # Параметры синтеза
+        kwargs = {'text': text, 'file_path': out}
         
-        # Блокируем доступ к модели, чтобы избежать гонки потоков на GPU
-        # Это делает обработку последовательной, но безопасной
-        with self._lock:
-            print(f"\n{'='*60}")
-            print(f"[{datetime.now().strftime('%H:%M:%S.%f')[:-3]}] 🎬 Starting synthesis (Lock acquired)")
-            print(f"  Model: {model_id}, Language: {language}, Speaker: {speaker}")
-            print(f"  Parts: {len(parts)}, Format: {out_format}")
-            print(f"{'='*60}")
-            
-            start_time = time.time()
-            
-            print(f"[{datetime.now().strftime('%H:%M:%S.%f')[:-3]}] 📥 Getting TTS instance...")
-            tts = self._get_tts(model_id)
-            load_time = time.time() - start_time
-            print(f"[{datetime.now().strftime('%H:%M:%S.%f')[:-3]}] ✓ TTS loaded ({load_time:.2f}s)")
+        # XTTS и мульти-язычные модели требуют language
+        if hasattr(tts, 'is_multi_lingual') and tts.is_multi_lingual:
+            kwargs['language'] = language
+        
+        # Для XTTS моделей используем speaker_wav
+        if 'xtts' in model_id or 'goblin' in model_id:
+            if stopping_criteria is not None:
+                kwargs['stopping_criteria'] = stopping_criteria
+            # Используем дефолтный спикер если не указан
+            default_speaker = 'female-1'
+            if 'goblin' in model_id:
+                # Для гоблина всегда стараемся использовать его голос
+                if 'goblin' in self.default_speakers:
+                    default_speaker = 'goblin'
+                
+            # Если спикер не передан или пустая строка (из формы), используем дефолтный
+            speaker_id = speaker if (speaker and speaker.strip()) else default_speaker
+            speaker_wav_path = os.path.join(self._speaker_samples_dir, f'{speaker_id}.wav')
             
-            tmp_files = []
-            try:
-                for i, p in enumerate(parts):
-                    part_start = time.time()
+            if os.path.exists(speaker_wav_path):
+                kwargs['speaker_wav'] = speaker_wav_path
+                print(f"[{datetime.now().strftime('%H:%M:%S.%f')[:-3]}]   Using speaker sample: {speaker_id}")
+            else:
+                print(f"[{datetime.now().strftime('%H:%M:%S.%f')[:-3]}]   ⚠️  Speaker sample not found: {speaker_wav_path}, using default")
+                # Попробуем использовать первый доступный
+                for default_speaker in self.default_speakers.keys():
+                    default_path = os.path.join(self._speaker_samples_dir, f'{default_speaker}.wav')
+                    if os.path.exists(default_path):
+                        kwargs['speaker_wav'] = default_path
+                        print(f"[{datetime.now().strftime('%H:%M:%S.%f')[:-3]}]   Using fallback speaker: {default_speaker}")
+                        break
+        else:
+            # Для других моделей используем speaker name если доступен
+            if hasattr(tts, 'is_multi_speaker') and tts.is_multi_speaker:
+                if hasattr(tts, 'speakers') and tts.speakers and len(tts.speakers) > 0:
+                    if speaker:
+                        kwargs['speaker'] = speaker
+                    else:
+                        kwargs['speaker'] = tts.speakers[0]
+                        print(f"[{datetime.now().strftime('%H:%M:%S.%f')[:-3]}]   Using default speaker: {tts.speakers[0]}")
+        
+        tts.tts_to_file(**kwargs)
+
+    def _iter_parts(self, parts: List[str], model_id: str, language: str, speaker: str,
+                    cancel_event=None, deadline: float = None, priority: str = 'interactive'):
+        """
+        Синтез частей текста с выдачей wav-файлов строго по порядку.
+        Одновременно синтезируется не больше segment_parallelism частей запроса,
+        каждая часть отдельно получает слот планировщика и реплику модели.
+        Выданные файлы удаляет вызывающий код.
+        """
+        import time
+        from datetime import datetime
+        from concurrent.futures import ThreadPoolExecutor
+
+        abort = threading.Event()
+
+        def check():
+            if abort.is_set():
+                raise SynthesisCancelled('Synthesis aborted')
+            self._check_cancelled(cancel_event, deadline)
+
+        stopping_criteria = self._stopping_criteria(check)
+        # Все части запроса стоят в очереди с момента его поступления (старение не сбрасывается)
+        since = time.monotonic()
+        remaining = [sum(len(p) for p in parts[i:]) for i in range(len(parts))]
+
+        parallelism = max(1, min(self.segment_parallelism, len(parts)))
+
+        def check_budget(i: int):
+            # Не тратим движок на ответ, который заведомо придёт после дедлайна:
+            # оставшийся хвост запроса синтезируется не более чем в parallelism потоков
+            if deadline is None:
+                return
+            tail = self.scheduler.estimate(model_id, remaining[i], len(parts) - i) / parallelism
+            if time.monotonic() + tail > deadline:
+                raise DeadlineExceeded('Synthesis cancelled: deadline cannot be met')
+
+        def check_part(i: int):
+            check()
+            check_budget(i)
+
+        def render(i: int, p: str) -> str:
+            check_part(i)
+            # Оценка стоимости - весь оставшийся хвост запроса, чтобы длинные запросы не обгоняли короткие
+            with self.scheduler.slot(model_id, remaining[i], len(parts) - i, priority=priority,
+                                     check=lambda: check_part(i), since=since):
+                check_part(i)
+                with self._replica(model_id) as tts:
                     print(f"\n[{datetime.now().strftime('%H:%M:%S.%f')[:-3]}] 🔊 Synthesizing part {i+1}/{len(parts)}: '{p[:50]}...'")
-                    
                     fd = tempfile.NamedTemporaryFile(suffix='.wav', delete=False)
                     out = fd.name
                     fd.close()
-                    
-                    # Параметры синтеза
-                    kwargs = {'text': p, 'file_path': out}
-                    
-                    # XTTS и мульти-язычные модели требуют language
-                    if hasattr(tts, 'is_multi_lingual') and tts.is_multi_lingual:
-                        kwargs['language'] = language
-                    
-                    # Для XTTS моделей используем speaker_wav
-                    if 'xtts' in model_id or 'goblin' in model_id:
-                        # Используем дефолтный спикер если не указан
-                        default_speaker = 'female-1'
-                        if 'goblin' in model_id:
-                            # Для гоблина всегда стараемся использовать его голос
-                            if 'goblin' in self.default_speakers:
-                                default_speaker = 'goblin'
-                            
-                        # Если спикер не передан или пустая строка (из формы), используем дефолтный
-                        speaker_id = speaker if (speaker and speaker.strip()) else default_speaker
-                        speaker_wav_path = os.path.join(self._speaker_samples_dir, f'{speaker_id}.wav')
-                        
-                        if os.path.exists(speaker_wav_path):
-                            kwargs['speaker_wav'] = speaker_wav_path
-                            print(f"[{datetime.now().strftime('%H:%M:%S.%f')[:-3]}]   Using speaker sample: {speaker_id}")
-                        else:
-                            print(f"[{datetime.now().strftime('%H:%M:%S.%f')[:-3]}]   ⚠️  Speaker sample not found: {speaker_wav_path}, using default")
-                            # Попробуем использовать первый доступный
-                            for default_speaker in self.default_speakers.keys():
-                                default_path = os.path.join(self._speaker_samples_dir, f'{default_speaker}.wav')
-                                if os.path.exists(default_path):
-                                    kwargs['speaker_wav'] = default_path
-                                    print(f"[{datetime.now().strftime('%H:%M:%S.%f')[:-3]}]   Using fallback speaker: {default_speaker}")
-                                    break
-                    else:
-                        # Для других моделей используем speaker name если доступен
-                        if hasattr(tts, 'is_multi_speaker') and tts.is_multi_speaker:
-                            if hasattr(tts, 'speakers') and tts.speakers and len(tts.speakers) > 0:
-                                if speaker:
-                                    kwargs['speaker'] = speaker
-                                else:
-                                    kwargs['speaker'] = tts.speakers[0]
-                                    print(f"[{datetime.now().strftime('%H:%M:%S.%f')[:-3]}]   Using default speaker: {tts.speakers[0]}")
-                    
-                    print(f"[{datetime.now().strftime('%H:%M:%S.%f')[:-3]}]   🚀 Calling TTS engine...")
-                    tts_start = time.time()
-                    tts.tts_to_file(**kwargs)
-                    tts_time = time.time() - tts_start
-                    
-                    part_time = time.time() - part_start
-                    print(f"[{datetime.now().strftime('%H:%M:%S.%f')[:-3]}]   ✓ Part {i+1} done: TTS={tts_time:.2f}s, Total={part_time:.2f}s")
-                    
-                    tmp_files.append(out)
-
-                # Объединяем части
-                print(f"\n[{datetime.now().strftime('%H:%M:%S.%f')[:-3]}] 🔗 Combining {len(tmp_files)} audio parts...")
-                combine_start = time.time()
-                combined = AudioSegment.empty()
-                for f in tmp_files:
-                    seg = AudioSegment.from_wav(f)
-                    combined += seg
-
-                out_path = tempfile.NamedTemporaryFile(suffix='.' + out_format, delete=False).name
-                if out_format == 'wav':
-                    combined.export(out_path, format='wav')
-                elif out_format == 'mp3':
-                    combined.export(out_path, format='mp3')
-                else:
-                    raise ValueError(f'Unsupported format: {out_format}')
-                
-                combine_time = time.time() - combine_start
-                total_time = time.time() - start_time
-                
-                print(f"[{datetime.now().strftime('%H:%M:%S.%f')[:-3]}] ✓ Combining done ({combine_time:.2f}s)")
-                print(f"\n{'='*60}")
-                print(f"[{datetime.now().strftime('%H:%M:%S.%f')[:-3]}] ✅ SYNTHESIS COMPLETE")
-                print(f"  Total time: {total_time:.2f}s")
-                print(f"  Output: {out_path}")
-                print(f"{'='*60}\n")
-                
-                return out_path
-            finally:
-                for f in tmp_files:
                     try:
-                        os.remove(f)
-                    except Exception:
-                        pass
+                        tts_start = time.time()
+                        self._synthesize_part(tts, p, out, model_id, language, speaker, stopping_criteria)
+                        tts_time = time.time() - tts_start
+                        # Генерация могла быть остановлена изнутри движка - не отдаём обрезанный результат
+                        check()
+                    except BaseException:
+                        os.remove(out)
+                        raise
+            self.scheduler.observe(model_id, len(p), 1, tts_time)
+            print(f"[{datetime.now().strftime('%H:%M:%S.%f')[:-3]}]   ✓ Part {i+1} done: TTS={tts_time:.2f}s")
+            return out
+
+        pool = ThreadPoolExecutor(max_workers=parallelism, thread_name_prefix='tts-part')
+        futures = [pool.submit(render, i, p) for i, p in enumerate(parts)]
+        done = 0
+        try:
+            for future in futures:
+                out = future.result()
+                done += 1
+                try:
+                    # Часть могла быть готова заранее - проверяем, нужна ли она ещё
+                    check()
+                except SynthesisCancelled:
+                    os.remove(out)
+                    raise
+                yield out
+        finally:
+            # Ошибка, отмена или клиент ушёл: останавливаем оставшиеся части и чистим их файлы
+            abort.set()
+            for future in futures[done:]:
+                future.cancel()
+            pool.shutdown(wait=True)
+            for future in futures[done:]:
+                if future.cancelled() or future.exception() is not None:
+                    continue
+                try:
+                    os.remove(future.result())
+                except Exception:
+                    pass
+
+    def synthesize_to_file(self, parts: List[str], model_id: str = 'xtts-v2', language: str = 'en', speaker: str = None, out_format: str = 'wav',
+                           cancel_event=None, deadline: float = None, priority: str = 'interactive') -> str:
+        import time
+        from datetime import datetime
+        
+        # Доступ к модели выдаёт планировщик, чтобы избежать гонки потоков на GPU.
+        # Короткие задачи проходят раньше длинных; отменённые запросы покидают очередь.
+        print(f"\n{'='*60}")
+        print(f"[{datetime.now().strftime('%H:%M:%S.%f')[:-3]}] 🎬 Starting synthesis")
+        print(f"  Model: {model_id}, Language: {language}, Speaker: {speaker}")
+        print(f"  Parts: {len(parts)}, Format: {out_format}, Priority: {priority}")
+        print(f"{'='*60}")
+        
+        start_time = time.time()
+        
+        tmp_files = []
+        try:
+            for out in self._iter_parts(parts, model_id, language, speaker, cancel_event, deadline, priority):
+                tmp_files.append(out)
+
+            # Объединяем части
+            print(f"\n[{datetime.now().strftime('%H:%M:%S.%f')[:-3]}] 🔗 Combining {len(tmp_files)} audio parts...")
+            combine_start = time.time()
+            combined = AudioSegment.empty()
+            for f in tmp_files:
+                seg = AudioSegment.from_wav(f)
+                combined += seg
+
+            out_path = tempfile.NamedTemporaryFile(suffix='.' + out_format, delete=False).name
+            export_audio(combined, out_path, out_format)
+            
+            combine_time = time.time() - combine_start
+            total_time = time.time() - start_time
+            
+            print(f"[{datetime.now().strftime('%H:%M:%S.%f')[:-3]}] ✓ Combining done ({combine_time:.2f}s)")
+            print(f"\n{'='*60}")
+            print(f"[{datetime.now().strftime('%H:%M:%S.%f')[:-3]}] ✅ SYNTHESIS COMPLETE")
+            print(f"  Total time: {total_time:.2f}s")
+            print(f"  Output: {out_path}")
+            print(f"{'='*60}\n")
+            
+            return out_path
+        finally:
+            for f in tmp_files:
+                try:
+                    os.remove(f)
+                except Exception:
+                    pass
+
+    def synthesize_stream(self, parts: List[str], model_id: str = 'xtts-v2', language: str = 'en', speaker: str = None,
+                          out_format: str = 's16le', cancel_event=None, deadline: float = None, priority: str = 'interactive',
+                          sample_rate: int = None, channels: int = None, on_complete=None):
+        """
+        Потоковый синтез: сырые аудиоданные каждой части выдаются по порядку, как только готов префикс.
+        После последней части собранный родной wav передаётся в on_complete (файл удаляет вызывающий код).
+        """
+        if out_format not in RAW_FORMATS:
+            raise ValueError(f'Streaming is supported only for raw formats: {", ".join(RAW_FORMATS)}')
+        combined = AudioSegment.empty()
+        outputs = self._iter_parts(parts, model_id, language, speaker, cancel_event, deadline, priority)
+        try:
+            for out in outputs:
+                try:
+                    seg = AudioSegment.from_wav(out)
+                finally:
+                    os.remove(out)
+                combined += seg
+                yield encode_raw(seg, out_format, sample_rate=sample_rate, channels=channels)
+        finally:
+            # При close() останавливаем оставшиеся части и удаляем их файлы здесь же
+            outputs.close()
+        if on_complete is not None:
+            wav_path = tempfile.NamedTemporaryFile(suffix='.wav', delete=False).name
+            export_audio(combined, wav_path, 'wav')
+            on_complete(wav_path)
+
+    def transcode_file(self, src_path: str, out_format: str, sample_rate: int = None, channels: int = None) -> str:
+        """Перекодирование готового wav в другой профиль вывода без повторного синтеза"""
+        out_path = tempfile.NamedTemporaryFile(suffix='.' + out_format, delete=False).name
+        export_audio(AudioSegment.from_wav(src_path), out_path, out_format, sample_rate=sample_rate, channels=channels)
+        return out_path
 
     def create_speaker(self, speaker_id: str, audio_file) -> dict:
         """Создание нового спикера из аудиофайла"""
@@ -1,21 +1,155 @@
+import re
 from typing import List
 
+def _split_words(text: str, max_len: int) -> List[str]:
+    parts = []
+    cur = ''
+    for token in text.split(' '):
+        if len(cur) + len(token) + 1 > max_len:
+            parts.append(cur.strip())
+            cur = token
+        else:
+            cur = (cur + ' ' + token).strip()
+    if cur:
+        parts.append(cur.strip())
+    return parts
+
 def split_text(text: str, max_len: int = 900) -> List[str]:
     """
     Простая логика разбиения: по предложениям, либо по пробелам.
     Разбивает текст на части, не превышающие max_len символов.
+    Предложения собираются в части целиком; слишком длинные режутся по пробелам.
     """
     if len(text) <= max_len:
         return [text]
 
     parts = []
     cur = ''
-    for token in text.split(' '):
-        if len(cur) + len(token) + 1 > max_len:
-            parts.append(cur.strip())
-            cur = token
+    for sentence in re.split(r'(?<=[.!?…])\s+', text.strip()):
+        if len(sentence) > max_len:
+            if cur:
+                parts.append(cur)
+                cur = ''
+            parts.extend(_split_words(sentence, max_len))
+        elif len(cur) + len(sentence) + 1 > max_len:
+            parts.append(cur)
+            cur = sentence
         else:
-            cur = (cur + ' ' + token).strip()
+            cur = (cur + ' ' + sentence).strip()
     if cur:
-        parts.append(cur.strip())
-    return parts
+        parts.append(cur)
+    return [p for p in parts if p]
+
+# Форматы вывода: контейнеры (через pydub) и "сырые" потоки для телефонии
+MEDIA_TYPES = {
+    'wav': 'audio/wav',
+    'mp3': 'audio/mp3',
+    'ulaw': 'audio/basic',
+    'alaw': 'audio/x-alaw-basic',
+    's16le': 'application/octet-stream',
+}
+RAW_FORMATS = ('ulaw', 'alaw', 's16le')
+
+def resample(samples, src_rate: int, dst_rate: int):
+    """
+    Векторизованный ресемплинг float-сигнала формы (n, channels).
+    При понижении частоты сначала фильтр нижних частот (windowed sinc),
+    затем линейная интерполяция на новую сетку.
+    """
+    import numpy as np
+
+    if src_rate == dst_rate or len(samples) == 0:
+        return samples
+    if dst_rate < src_rate:
+        # Срез чуть ниже новой частоты Найквиста, чтобы избежать алиасинга
+        cutoff = 0.45 * dst_rate / src_rate
+        taps = np.arange(-32, 33)
+        kernel = 2 * cutoff * np.sinc(2 * cutoff * taps) * np.hamming(len(taps))
+        kernel /= kernel.sum()
+        samples = np.stack(
+            [np.convolve(samples[:, c], kernel, mode='same') for c in range(samples.shape[1])],
+            axis=1
+        )
+    n_out = int(round(len(samples) * dst_rate / src_rate))
+    src_t = np.arange(len(samples)) / src_rate
+    dst_t = np.arange(n_out) / dst_rate
+    return np.stack(
+        [np.interp(dst_t, src_t, samples[:, c]) for c in range(samples.shape[1])],
+        axis=1
+    )
+
+def lin2ulaw(pcm):
+    """G.711 μ-law кодирование int16 массива (векторизованная версия g711.c)"""
+    import numpy as np
+
+    pcm = pcm.astype(np.int32) >> 2
+    mask = np.where(pcm < 0, 0x7F, 0xFF)
+    pcm = np.minimum(np.abs(pcm), 8159) + (0x84 >> 2)
+    seg = np.searchsorted(np.array([0x3F, 0x7F, 0xFF, 0x1FF, 0x3FF, 0x7FF, 0xFFF, 0x1FFF]), pcm)
+    uval = (seg << 4) | ((pcm >> (seg + 1)) & 0x0F)
+    uval = np.where(seg >= 8, 0x7F, uval)
+    return (uval ^ mask).astype(np.uint8)
+
+def lin2alaw(pcm):
+    """G.711 A-law кодирование int16 массива (векторизованная версия g711.c)"""
+    import numpy as np
+
+    pcm = pcm.astype(np.int32) >> 3
+    mask = np.where(pcm >= 0, 0xD5, 0x55)
+    pcm = np.where(pcm >= 0, pcm, -pcm - 1)
+    seg = np.searchsorted(np.array([0x1F, 0x3F, 0x7F, 0xFF, 0x1FF, 0x3FF, 0x7FF, 0xFFF]), pcm)
+    aval = (seg << 4) | (np.where(seg < 2, pcm >> 1, pcm >> seg) & 0x0F)
+    aval = np.where(seg >= 8, 0x7F, aval)
+    return (aval ^ mask).astype(np.uint8)
+
+def _to_pcm(segment, sample_rate: int = None, channels: int = None):
+    """AudioSegment -> int16 массив (interleaved) в нужной частоте и числе каналов"""
+    import numpy as np
+
+    sample_rate = sample_rate or segment.frame_rate
+    channels = channels or segment.channels
+    # Переводим в float [-1, 1] формы (n, channels)
+    scale = float(1 << (8 * segment.sample_width - 1))
+    samples = np.array(segment.get_array_of_samples(), dtype=np.float32).reshape(-1, segment.channels) / scale
+    if channels != segment.channels:
+        mono = samples.mean(axis=1, keepdims=True)
+        samples = np.repeat(mono, channels, axis=1)
+    samples = resample(samples, segment.frame_rate, sample_rate)
+    return (np.clip(samples, -1.0, 1.0) * 32767).astype(np.int16).reshape(-1)
+
+def encode_raw(segment, out_format: str, sample_rate: int = None, channels: int = None) -> bytes:
+    """Кодирование AudioSegment в сырой поток ulaw/alaw/s16le"""
+    pcm = _to_pcm(segment, sample_rate, channels)
+    if out_format == 'ulaw':
+        return lin2ulaw(pcm).tobytes()
+    if out_format == 'alaw':
+        return lin2alaw(pcm).tobytes()
+    if out_format == 's16le':
+        return pcm.astype('<i2').tobytes()
+    raise ValueError(f'Unsupported raw format: {out_format}')
+
+def export_audio(segment, out_path: str, out_format: str, sample_rate: int = None, channels: int = None):
+    """
+    Сохранение AudioSegment в нужном профиле: частота, число каналов, кодек.
+    wav/mp3 пишутся через pydub, ulaw/alaw/s16le - как сырой поток без заголовка.
+    """
+    from pydub import AudioSegment
+
+    if out_format not in MEDIA_TYPES:
+        raise ValueError(f'Unsupported format: {out_format}')
+
+    if out_format in RAW_FORMATS:
+        with open(out_path, 'wb') as f:
+            f.write(encode_raw(segment, out_format, sample_rate=sample_rate, channels=channels))
+        return
+
+    sample_rate = sample_rate or segment.frame_rate
+    channels = channels or segment.channels
+    if sample_rate != segment.frame_rate or channels != segment.channels:
+        segment = AudioSegment(
+            data=_to_pcm(segment, sample_rate, channels).tobytes(),
+            sample_width=2,
+            frame_rate=sample_rate,
+            channels=channels
+        )
+    segment.export(out_path, format=out_format)
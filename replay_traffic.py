@@ -0,0 +1,135 @@
+import asyncio
+import aiohttp
+import time
+import json
+import random
+import argparse
+import statistics
+from datetime import datetime
+
+# Словари для генерации текста-заглушки: в захвате хранится только длина и хэш текста
+WORDS = {
+    'ru': "привет это тест синтеза речи при нагрузке сервис отвечает быстро и без ошибок".split(),
+    'en': "hello this is a replay of captured traffic for speech synthesis load testing".split(),
+}
+
+def load_capture(path):
+    entries = []
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            entries.append(json.loads(line))
+    entries.sort(key=lambda e: e['ts'])
+    return entries
+
+def make_text(entry):
+    """
+    Детерминированный текст той же длины: одинаковый хэш -> одинаковый текст,
+    поэтому повторы в исходном трафике остаются повторами (и попаданиями в кэш).
+    """
+    rnd = random.Random(entry['text_hash'])
+    words = WORDS.get(entry.get('language'), WORDS['en'])
+    text = ''
+    while len(text) < entry['text_len']:
+        text = (text + ' ' + rnd.choice(words)).strip()
+    return text[:entry['text_len']]
+
+async def replay_request(session, url, entry, request_id):
+    start_time = time.time()
+    data = {
+        'text': make_text(entry),
+        'model_id': entry.get('model_id', 'xtts-v2'),
+        'language': entry.get('language', 'en'),
+        'fmt': entry.get('fmt', 'wav'),
+    }
+    if entry.get('speaker'):
+        data['speaker'] = entry['speaker']
+    for field in ('sample_rate', 'channels'):
+        if entry.get(field):
+            data[field] = str(entry[field])
+    if entry.get('stream'):
+        data['stream'] = 'true'
+    if entry.get('deadline_ms'):
+        data['deadline_ms'] = str(entry['deadline_ms'])
+    if entry.get('priority'):
+        data['priority'] = entry['priority']
+    try:
+        async with session.post(url, data=data) as response:
+            await response.read()
+            duration = time.time() - start_time
+            status = response.status
+            cache_status = response.headers.get('X-Cache', '-')
+            print(f"[{datetime.now().strftime('%H:%M:%S')}] Request {request_id}: Status {status}, Cache {cache_status}, Time {duration:.2f}s")
+            return duration, status, cache_status
+    except Exception as e:
+        print(f"Request {request_id} failed: {e}")
+        return 0, 0, '-'
+
+def positive_float(value):
+    value = float(value)
+    if value <= 0:
+        raise argparse.ArgumentTypeError('must be greater than 0')
+    return value
+
+def percentile(values, p):
+    if len(values) == 1:
+        return values[0]
+    return statistics.quantiles(values, n=100, method='inclusive')[p - 1]
+
+async def run_replay(entries, url, speed):
+    print(f"\nReplaying {len(entries)} captured requests (speed x{speed})...")
+    print(f"Target URL: {url}")
+
+    async with aiohttp.ClientSession() as session:
+        tasks = []
+        start_total = time.time()
+        first_ts = entries[0]['ts']
+
+        for i, entry in enumerate(entries):
+            # Сохраняем исходные интервалы между запросами с учётом масштаба
+            delay = (entry['ts'] - first_ts) / speed - (time.time() - start_total)
+            if delay > 0:
+                await asyncio.sleep(delay)
+            task = asyncio.create_task(replay_request(session, url, entry, i+1))
+            tasks.append(task)
+
+        results = await asyncio.gather(*tasks)
+        total_time = time.time() - start_total
+
+    ok = [r for r in results if r[1] == 200]
+    durations = sorted(r[0] for r in ok)
+    hits = sum(1 for r in ok if r[2] == 'HIT')
+
+    print(f"\n{'='*40}")
+    print(f"Replay Results ({len(entries)} requests)")
+    print(f"{'='*40}")
+    print(f"Successful requests: {len(ok)}/{len(entries)}")
+    print(f"Total time: {total_time:.2f}s")
+
+    if durations:
+        print(f"Cache hit ratio: {hits / len(ok):.1%}")
+        print(f"p50 latency: {percentile(durations, 50):.2f}s")
+        print(f"p90 latency: {percentile(durations, 90):.2f}s")
+        print(f"p95 latency: {percentile(durations, 95):.2f}s")
+        print(f"p99 latency: {percentile(durations, 99):.2f}s")
+        print(f"Max latency: {durations[-1]:.2f}s")
+        print(f"Throughput: {len(ok) / total_time:.2f} req/s")
+    print(f"{'='*40}\n")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='TTS Traffic Replay')
+    parser.add_argument('capture', help='JSONL file written with CAPTURE_FILE')
+    parser.add_argument('--url', default='http://localhost:5000/synthesize', help='TTS API URL')
+    parser.add_argument('--speed', type=positive_float, default=1.0, help='Rate multiplier (2.0 = twice as fast as captured)')
+    parser.add_argument('--limit', type=int, default=0, help='Replay only the first N requests')
+    args = parser.parse_args()
+
+    entries = load_capture(args.capture)
+    if args.limit:
+        entries = entries[:args.limit]
+    if not entries:
+        print("Capture file is empty")
+    else:
+        asyncio.run(run_replay(entries, args.url, args.speed))